@@ -37,18 +37,34 @@
 
 import wx
 import serial
-import serial.threaded
 import serial.tools.list_ports
 import re
+import threading
+import logging
 
+LOG_LEVEL = logging.WARNING
 POLL_SERIAL_PORTS_INTERVALL = 4000
 POLL_COORDINATES_INTERVALL = 2500
 POLL_TEMPERATURE_INTERVALL = 3000
 MESH_DATA_RETRY_TIMEOUT = 2000
+POLL_RESPONSE_TIMEOUT = 10000
+POLL_TIMER_INTERVALL = 500
+SERIAL_READ_CHUNK_SIZE = 4096
 BUSY_PROCESSING_STEPS = 6;
+STATUS_LABEL_WIDTH = 80
+STATUS_LABEL_WIDTH_ZC = 100
+Z_DECIMALS = 4
+
+# All periodic tasks share one timer, these are their periods in timer ticks
+POLL_SERIAL_PORTS_TICKS = POLL_SERIAL_PORTS_INTERVALL // POLL_TIMER_INTERVALL
+POLL_COORDINATES_TICKS = POLL_COORDINATES_INTERVALL // POLL_TIMER_INTERVALL
+POLL_TEMPERATURE_TICKS = POLL_TEMPERATURE_INTERVALL // POLL_TIMER_INTERVALL
+MESH_DATA_RETRY_TICKS = MESH_DATA_RETRY_TIMEOUT // POLL_TIMER_INTERVALL
+POLL_RESPONSE_TIMEOUT_TICKS = POLL_RESPONSE_TIMEOUT // POLL_TIMER_INTERVALL
+
 AVAILABLE_BAUD_RATES = ["2400", "9600", "19200", "38400", "57600", "115200", "250000"]
 DEFAULT_BAUD_RATE = "115200"
-DEFAULT_SERIAL_PORTS = ["/dev/cu.usbserial-AI02LQH7", "/dev/cu.SLAB_USBtoUART"]
+DEFAULT_SERIAL_PORTS = frozenset(["/dev/cu.usbserial-AI02LQH7", "/dev/cu.SLAB_USBtoUART"])
 
 GCODE_EEPROM_SAVE = "M500"
 GCODE_STOP_IDLE_HOLD = "M84"
@@ -57,21 +73,45 @@ GCODE_GET_CURRENT_POSITION = "M114"
 GCODE_MESH_INFO = "G29 S0"
 GCODE_MESH_START = "G29 S1"
 GCODE_MESH_NEXT = "G29 S2"
-GCODE_MOVE_Z = "G1 Z{}"
-GCODE_SET_BED_TEMP = "M140 S{}"
+GCODE_MOVE_Z = "G1 Z%s"
+GCODE_SET_BED_TEMP = "M140 S%s"
 GCODE_GET_TEMP = "M105"
 
+# Polled commands, encoded and terminated once instead of on every write
+GCODE_LINE_GET_CURRENT_POSITION = GCODE_GET_CURRENT_POSITION.encode("ascii") + b"\n"
+GCODE_LINE_MESH_INFO = GCODE_MESH_INFO.encode("ascii") + b"\n"
+GCODE_LINE_GET_TEMP = GCODE_GET_TEMP.encode("ascii") + b"\n"
+
+# Encoded and terminated lines for the commands taking an argument
+def gcode_move_z(z):
+    return (GCODE_MOVE_Z % z).encode("ascii") + b"\n"
+
+def gcode_set_bed_temp(temp):
+    return (GCODE_SET_BED_TEMP % temp).encode("ascii") + b"\n"
+
 PRINTER_RESPONSE_OK = "ok"
 PRINTER_RESPONSE_BUSY = "echo:busy: processing"
-PRINTER_REGEX_COORDINATES = "^X:\d+\.\d+ Y:\d+\.\d+ Z:\d+\.\d+ E:\d+\.\d+ Count X:\s*\d+ Y:\s*\d+ Z:\s*\d+$"
-PRINTER_REGEX_MESH_POINTS = "^Num X,Y: \d,\d$"
-PRINTER_REGEX_MESH_Z = "^Z search height: \d\.*\d*$"
-PRINTER_REGEX_TEMP = "^ok T:\d\d*\.*\d* \/\d\d*\.*\d* B:\d\d*\.*\d* \/\d\d*\.*\d* B@:\d\d*\.*\d* @:\d\d*\.*\d*$"
-
-# Event for sending new XYZ coordinates from the serial thread to the GUI thread
-myEVT_COORDINATES = wx.NewEventType()
-EVT_COORDINATES = wx.PyEventBinder(myEVT_COORDINATES, 1)
-class CoordinatesEvent(wx.PyCommandEvent):
+PRINTER_PREFIX_COORDINATES = "X:"
+PRINTER_PREFIX_MESH_POINTS = "Num X,Y: "
+PRINTER_PREFIX_MESH_Z = "Z search height: "
+PRINTER_PREFIX_TEMP = "ok T:"
+PRINTER_REGEX_COORDINATES = r"^X:(-?\d+\.\d+) Y:(-?\d+\.\d+) Z:(-?\d+\.\d+) E:-?\d+\.\d+ Count X:\s*-?\d+ Y:\s*-?\d+ Z:\s*-?\d+$"
+PRINTER_REGEX_MESH_POINTS = r"^Num X,Y: (\d),(\d)$"
+PRINTER_REGEX_MESH_Z = r"^Z search height: (\d+(?:\.\d+)?)$"
+PRINTER_REGEX_TEMP = r"^ok T:-?\d+(?:\.\d+)? /-?\d+(?:\.\d+)?(?: B:(-?\d+(?:\.\d+)?) /-?\d+(?:\.\d+)?)?(?: B@:-?\d+(?:\.\d+)?)? @:-?\d+(?:\.\d+)?(?: B@:-?\d+(?:\.\d+)?)?$"
+
+# Pre-compiled matchers for the printer responses. handle_line always gets a
+# single line, so no multiline flag is needed.
+_RE_COORD = re.compile(PRINTER_REGEX_COORDINATES).match
+_RE_MESH_PTS = re.compile(PRINTER_REGEX_MESH_POINTS).match
+_RE_MESH_Z = re.compile(PRINTER_REGEX_MESH_Z).match
+_RE_TEMP = re.compile(PRINTER_REGEX_TEMP).match
+
+log = logging.getLogger("bedlvl")
+
+# Event carrying a single payload from the serial thread to the GUI thread,
+# used for all of the event types below
+class PayloadEvent(wx.PyCommandEvent):
     def __init__(self, etype, eid, value = None):
         wx.PyCommandEvent.__init__(self, etype, eid)
         self.value = value
@@ -79,110 +119,129 @@ class CoordinatesEvent(wx.PyCommandEvent):
     def GetValue(self):
         return self.value
 
-# Event for sending new mesh point info
+# Event for sending new XYZ coordinates as a tuple
+myEVT_COORDINATES = wx.NewEventType()
+EVT_COORDINATES = wx.PyEventBinder(myEVT_COORDINATES, 1)
+
+# Event for sending new mesh point info as a (x, y) tuple
 myEVT_MESH_POINTS = wx.NewEventType()
 EVT_MESH_POINTS = wx.PyEventBinder(myEVT_MESH_POINTS, 1)
-class MeshPointEvent(wx.PyCommandEvent):
-    def __init__(self, etype, eid, x = None, y = None):
-        wx.PyCommandEvent.__init__(self, etype, eid)
-        self.x = x
-        self.y = y
 
-    def GetX(self):
-        return self.x
-
-    def GetY(self):
-        return self.y
-
-# Event for sending new mesh point info
+# Event for sending the mesh starting height
 myEVT_MESH_Z = wx.NewEventType()
 EVT_MESH_Z = wx.PyEventBinder(myEVT_MESH_Z, 1)
-class MeshZEvent(wx.PyCommandEvent):
-    def __init__(self, etype, eid, z = None):
-        wx.PyCommandEvent.__init__(self, etype, eid)
-        self.z = z
 
-    def GetZ(self):
-        return self.z
-
-# Event for sending temperature info
+# Event for sending the bed temperature
 myEVT_TEMPERATURE = wx.NewEventType()
 EVT_TEMPERATURE = wx.PyEventBinder(myEVT_TEMPERATURE, 1)
-class TemperatureEvent(wx.PyCommandEvent):
-    def __init__(self, etype, eid, bed = None):
-        wx.PyCommandEvent.__init__(self, etype, eid)
-        self.bed = bed
-
-    def GetBed(self):
-        return self.bed
 
 # Event for sending a new busy indicator status update
 myEVT_STATUS = wx.NewEventType()
 EVT_STATUS = wx.PyEventBinder(myEVT_STATUS, 1)
-class StatusEvent(wx.PyCommandEvent):
-    def __init__(self, etype, eid, value = None):
-        wx.PyCommandEvent.__init__(self, etype, eid)
-        self.value = value
 
-    def GetValue(self):
-        return self.value
+# Event for reporting a lost serial connection with the error message
+myEVT_CONNECTION_LOST = wx.NewEventType()
+EVT_CONNECTION_LOST = wx.PyEventBinder(myEVT_CONNECTION_LOST, 1)
 
-# Serial Thread reading from and writing to the printer, line-based
-class GCodeReader(serial.threaded.LineReader):
+# Serial Thread reading from and writing to the printer, line-based.
+# Reads everything that is waiting in one go instead of going through
+# serial.threaded, which cuts down the number of read calls considerably.
+class GCodeReader(threading.Thread):
 
     TERMINATOR = b'\n'
+    ENCODING = 'utf-8'
+    UNICODE_HANDLING = 'replace'
 
-    regexCoordinates = re.compile(PRINTER_REGEX_COORDINATES, re.M)
-    regexMeshPoints = re.compile(PRINTER_REGEX_MESH_POINTS, re.M)
-    regexMeshZ = re.compile(PRINTER_REGEX_MESH_Z, re.M)
-    regexTemp = re.compile(PRINTER_REGEX_TEMP, re.M)
-
-    def setParent(self, parent):
+    def __init__(self, serialInstance, parent):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.serial = serialInstance
         self.parent = parent
+        self.alive = True
+        self.lock = threading.Lock()
+
+    def run(self):
+        if not hasattr(self.serial, 'cancel_read'):
+            self.serial.timeout = 1
+        buffer = bytearray()
+        try:
+            while self.alive and self.serial.is_open:
+                try:
+                    # Block for at least one byte, then grab whatever else is waiting
+                    data = self.serial.read(min(max(1, self.serial.in_waiting), SERIAL_READ_CHUNK_SIZE))
+                except (serial.SerialException, OSError) as msg:
+                    log.error("Serial port error: %s", msg)
+                    event = PayloadEvent(myEVT_CONNECTION_LOST, -1, str(msg))
+                    wx.PostEvent(self.parent, event)
+                    break
+                if not data:
+                    continue
+                buffer.extend(data)
+                if self.TERMINATOR not in buffer:
+                    continue
+                lines = buffer.split(self.TERMINATOR)
+                buffer = lines.pop()
+                for line in lines:
+                    self.handle_line(line.decode(self.ENCODING, self.UNICODE_HANDLING))
+        finally:
+            self.alive = False
+
+    def write(self, data):
+        with self.lock:
+            self.serial.write(data)
+
+    def write_line(self, text):
+        self.write(text.encode(self.ENCODING, self.UNICODE_HANDLING) + self.TERMINATOR)
+
+    def close(self):
+        self.alive = False
+        if hasattr(self.serial, 'cancel_read'):
+            self.serial.cancel_read()
+        if self.is_alive():
+            self.join(2)
 
     def handle_line(self, data):
-        if data == PRINTER_RESPONSE_OK:
-            event = StatusEvent(myEVT_STATUS, -1, 0)
+        # Ordered by how often the responses show up. The cheap prefix tests
+        # avoid running the regular expressions on lines that can't match.
+        # Replies to the polls are always posted, with a None payload if they
+        # can't be parsed, so the poll still counts as answered.
+        if data.startswith(PRINTER_PREFIX_TEMP):
+            match = _RE_TEMP(data)
+            # Printers without a heated bed don't report it at all
+            bed = match.group(1) if match else None
+            event = PayloadEvent(myEVT_TEMPERATURE, -1, float(bed) if bed is not None else None)
             wx.PostEvent(self.parent, event)
             return
 
-        if data == PRINTER_RESPONSE_BUSY:
-            event = StatusEvent(myEVT_STATUS, -1, 1)
+        if data.startswith(PRINTER_PREFIX_COORDINATES):
+            match = _RE_COORD(data)
+            event = PayloadEvent(myEVT_COORDINATES, -1, match.group(1, 2, 3) if match else None)
             wx.PostEvent(self.parent, event)
             return
 
-        if self.regexCoordinates.match(data):
-            afterX = data.split("X:")[1]
-            x = afterX.split(" ")[0]
-            afterY = data.split("Y:")[1]
-            y = afterY.split(" ")[0]
-            afterZ = data.split("Z:")[1]
-            z = afterZ.split(" ")[0]
-            str = "X: {} Y: {} Z: {}".format(x, y, z)
-            event = CoordinatesEvent(myEVT_COORDINATES, -1, str)
+        if data == PRINTER_RESPONSE_OK:
+            event = PayloadEvent(myEVT_STATUS, -1, 0)
             wx.PostEvent(self.parent, event)
             return
 
-        if self.regexMeshPoints.match(data):
-            firstDigit = data.split("X,Y: ")[1]
-            x = firstDigit.split(",")[0]
-            y = firstDigit.split(",")[1]
-            event = MeshPointEvent(myEVT_MESH_POINTS, -1, x, y)
+        if data == PRINTER_RESPONSE_BUSY:
+            event = PayloadEvent(myEVT_STATUS, -1, 1)
             wx.PostEvent(self.parent, event)
             return
 
-        if self.regexMeshZ.match(data):
-            num = data.split("Z search height: ")[1]
-            event = MeshZEvent(myEVT_MESH_Z, -1, float(num))
-            wx.PostEvent(self.parent, event)
-            return
+        if data.startswith(PRINTER_PREFIX_MESH_POINTS):
+            match = _RE_MESH_PTS(data)
+            if match:
+                event = PayloadEvent(myEVT_MESH_POINTS, -1, match.group(1, 2))
+                wx.PostEvent(self.parent, event)
+                return
 
-        if self.regexTemp.match(data):
-            bed = data.split(" B:")[1]
-            temp = bed.split(" /")[0]
-            event = TemperatureEvent(myEVT_TEMPERATURE, -1, float(temp))
-            wx.PostEvent(self.parent, event)
-            return
+        if data.startswith(PRINTER_PREFIX_MESH_Z):
+            match = _RE_MESH_Z(data)
+            if match:
+                event = PayloadEvent(myEVT_MESH_Z, -1, float(match.group(1)))
+                wx.PostEvent(self.parent, event)
+                return
 
 # Main Window class
 class WizardFrame(wx.Frame):
@@ -192,10 +251,13 @@ class WizardFrame(wx.Frame):
         self.hasQuit = False
         self.isConnected = False
         self.serial = serial.Serial()
-        self.thread = serial.threaded.ReaderThread(self.serial, GCodeReader)
+        self.thread = GCodeReader(self.serial, self)
         self.isLeveling = False
         self.currentPoint = 0
         self.meshPoints = -1
+        self.isPollingMeshData = False
+        self.positionPollTick = None
+        self.temperaturePollTick = None
         self.step = 0.025
         self.currentZ = 0.0
         self.startZ = 0.0
@@ -205,6 +267,7 @@ class WizardFrame(wx.Frame):
         self.Bind(EVT_MESH_POINTS, self.OnMeshPoints)
         self.Bind(EVT_MESH_Z, self.OnMeshZ)
         self.Bind(EVT_TEMPERATURE, self.OnTemperature)
+        self.Bind(EVT_CONNECTION_LOST, self.OnConnectionLost)
 
         # Menubar and Items
         MenuBar = wx.MenuBar()
@@ -214,7 +277,9 @@ class WizardFrame(wx.Frame):
         item = FileMenu.Append(wx.ID_EXIT, text = "&Exit")
         self.Bind(wx.EVT_MENU, self.OnQuit, item)
         self.Bind(wx.EVT_CLOSE, self.OnQuit)
-        self.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
+
+        # Keyboard shortcuts, seen by the frame before the focused widget
+        self.Bind(wx.EVT_CHAR_HOOK, self.OnCharHook)
 
         outerPanelSizer = wx.BoxSizer(wx.VERTICAL)
 
@@ -223,78 +288,69 @@ class WizardFrame(wx.Frame):
         panelSerialSizer = wx.BoxSizer(wx.HORIZONTAL)
         self.panelSerial.SetSizer(panelSerialSizer)
         outerPanelSizer.Add(self.panelSerial, 0, wx.TOP | wx.EXPAND, 4)
-        self.panelSerial.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
         # List all available serial ports
-        serialPortList = serial.tools.list_ports.comports()
-        serialPortNames = []
-        for port in serialPortList:
-            serialPortNames.append(port[0])
+        serialPortNames = [port.device for port in serial.tools.list_ports.comports()]
 
         # Combobox for serial ports
         self.comboBoxSerial = wx.ComboBox(parent = self.panelSerial, choices = serialPortNames, style = wx.CB_READONLY)
         self.comboBoxSerial.SetMinSize((200, -1))
         panelSerialSizer.Add(self.comboBoxSerial, 1, wx.LEFT, 5)
-        self.comboBoxSerial.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
-        # Select default serial port(s)
-        for port in serialPortList:
-            if port[0] in DEFAULT_SERIAL_PORTS:
-                self.comboBoxSerial.SetStringSelection(port[0])
+        # Select default serial port, or the first one if none of them is present
+        defaultPort = next((name for name in serialPortNames if name in DEFAULT_SERIAL_PORTS), None)
+        if not defaultPort and serialPortNames:
+            defaultPort = serialPortNames[0]
+        if defaultPort:
+            self.comboBoxSerial.SetStringSelection(defaultPort)
 
-        # Regularly update serial port list
-        wx.FutureCall(POLL_SERIAL_PORTS_INTERVALL, self.EnumerateSerialPorts)
+        # Remember the listed ports so EnumerateSerialPorts can skip unchanged lists
+        self.lastSerialPorts = frozenset(serialPortNames)
 
         # Combobox for baudrates
         self.comboBoxBaud = wx.ComboBox(parent = self.panelSerial, choices = AVAILABLE_BAUD_RATES, style = wx.CB_READONLY)
         self.comboBoxBaud.SetMinSize((80, -1))
         panelSerialSizer.Add(self.comboBoxBaud, 0)
-        self.comboBoxBaud.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
-        for baud in AVAILABLE_BAUD_RATES:
-            if baud == DEFAULT_BAUD_RATE:
-                self.comboBoxBaud.SetStringSelection(DEFAULT_BAUD_RATE)
+        self.comboBoxBaud.SetStringSelection(DEFAULT_BAUD_RATE)
 
         # Button for connecting and disconnecting
         self.buttonSerial = wx.Button(parent = self.panelSerial, label = "Connect")
         self.buttonSerial.Bind(wx.EVT_BUTTON, self.OnConnectDisconnect)
         panelSerialSizer.Add(self.buttonSerial, 0, wx.TOP, 2)
         panelSerialSizer.AddSpacer(5)
-        self.buttonSerial.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
         # Panel for status labels
         self.panelStatus = wx.Panel(self)
         panelStatusSizer = wx.BoxSizer(wx.HORIZONTAL)
         self.panelStatus.SetSizer(panelStatusSizer)
         outerPanelSizer.Add(self.panelStatus, 0, wx.EXPAND | wx.TOP, 3)
-        self.panelStatus.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
-        # Labels for coordinates
-        self.labelX = wx.StaticText(parent = self.panelStatus, label = "X: ??.??")
+        # Labels for coordinates, fixed width so new values never need a re-layout
+        self.labelX = wx.StaticText(parent = self.panelStatus, label = "X: ??.??", style = wx.ST_NO_AUTORESIZE)
+        self.labelX.SetMinSize((STATUS_LABEL_WIDTH, -1))
         panelStatusSizer.Add(self.labelX, 0, wx.LEFT, 5)
         panelStatusSizer.AddStretchSpacer(1)
-        self.labelX.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
-        self.labelY = wx.StaticText(parent = self.panelStatus, label = "Y: ??.??")
+        self.labelY = wx.StaticText(parent = self.panelStatus, label = "Y: ??.??", style = wx.ST_NO_AUTORESIZE)
+        self.labelY.SetMinSize((STATUS_LABEL_WIDTH, -1))
         panelStatusSizer.Add(self.labelY, 0)
         panelStatusSizer.AddStretchSpacer(1)
-        self.labelY.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
-        self.labelZ = wx.StaticText(parent = self.panelStatus, label = "Z: ??.??")
+        self.labelZ = wx.StaticText(parent = self.panelStatus, label = "Z: ??.??", style = wx.ST_NO_AUTORESIZE)
+        self.labelZ.SetMinSize((STATUS_LABEL_WIDTH, -1))
         panelStatusSizer.Add(self.labelZ, 0, wx.RIGHT, 5)
         panelStatusSizer.AddStretchSpacer(1)
-        self.labelZ.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
-        self.labelZc = wx.StaticText(parent = self.panelStatus, label = "Zc: ??.???")
+        self.labelZc = wx.StaticText(parent = self.panelStatus, label = "Zc: ??.???", style = wx.ST_NO_AUTORESIZE)
+        self.labelZc.SetMinSize((STATUS_LABEL_WIDTH_ZC, -1))
         panelStatusSizer.Add(self.labelZc, 0, wx.RIGHT, 5)
-        self.labelZc.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
         # Panel for general actions
         self.panelAction = wx.Panel(self)
         panelActionSizer = wx.BoxSizer(wx.HORIZONTAL)
         self.panelAction.SetSizer(panelActionSizer)
         outerPanelSizer.Add(self.panelAction, 0, wx.EXPAND | wx.TOP, 5)
-        self.panelAction.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
         # Button for homing
         self.buttonHome = wx.Button(parent = self.panelAction, label = "Home")
@@ -302,7 +358,6 @@ class WizardFrame(wx.Frame):
         self.buttonHome.Enable(False)
         panelActionSizer.AddSpacer(5)
         panelActionSizer.Add(self.buttonHome, 0, wx.BOTTOM, 1)
-        self.buttonHome.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
         # Button for steppers off
         self.buttonOff = wx.Button(parent = self.panelAction, label = "Off")
@@ -310,32 +365,27 @@ class WizardFrame(wx.Frame):
         self.buttonOff.Enable(False)
         panelActionSizer.AddSpacer(5)
         panelActionSizer.Add(self.buttonOff, 0, wx.BOTTOM, 1)
-        self.buttonOff.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
         # Status Gauge
         self.gauge = wx.Gauge(parent = self.panelAction)
         self.gauge.SetRange(BUSY_PROCESSING_STEPS)
         panelActionSizer.Add(self.gauge, 1, wx.LEFT | wx.RIGHT, 5)
-        self.gauge.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
         # Bottom panel
         self.panelBottom = wx.Panel(self)
         panelBottomSizer = wx.BoxSizer(wx.HORIZONTAL)
         self.panelBottom.SetSizer(panelBottomSizer)
         outerPanelSizer.Add(self.panelBottom, 0, wx.EXPAND | wx.TOP, 5)
-        self.panelBottom.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
         # Config panel
         self.panelConfig = wx.Panel(self.panelBottom)
         panelConfigSizer = wx.BoxSizer(wx.VERTICAL)
         self.panelConfig.SetSizer(panelConfigSizer)
         panelBottomSizer.Add(self.panelConfig, 2, wx.EXPAND | wx.LEFT, 5)
-        self.panelConfig.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
         # Step Size Label
         stepSizeLabel = wx.StaticText(self.panelConfig, label="Step:")
         panelConfigSizer.Add(stepSizeLabel, 0, wx.LEFT, 5)
-        stepSizeLabel.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
         # Step Size Text Input
         self.stepSize = wx.TextCtrl(parent = self.panelConfig, value="0.025", style = wx.TE_DONTWRAP | wx.TE_PROCESS_ENTER)
@@ -347,7 +397,6 @@ class WizardFrame(wx.Frame):
         # Bed Temperature Label
         self.bedTemperatureLabel = wx.StaticText(self.panelConfig, label="Bed: ??.?")
         panelConfigSizer.Add(self.bedTemperatureLabel, 0, wx.LEFT | wx.TOP, 5)
-        self.bedTemperatureLabel.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
         # Bed Temperature Text Input
         self.bedTemperature = wx.TextCtrl(parent = self.panelConfig, value="0", style = wx.TE_DONTWRAP | wx.TE_PROCESS_ENTER)
@@ -361,7 +410,6 @@ class WizardFrame(wx.Frame):
         panelControlSizer = wx.BoxSizer(wx.VERTICAL)
         self.panelControl.SetSizer(panelControlSizer)
         panelBottomSizer.Add(self.panelControl, 2, wx.EXPAND | wx.LEFT, 5)
-        self.panelControl.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
         # Up Button
         self.buttonUp = wx.Button(parent = self.panelControl, label = "/\\")
@@ -369,7 +417,6 @@ class WizardFrame(wx.Frame):
         self.buttonUp.Enable(False)
         panelControlSizer.AddStretchSpacer(1)
         panelControlSizer.Add(self.buttonUp, 2, wx.ALIGN_CENTER_HORIZONTAL)
-        self.buttonUp.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
         # Down Button
         self.buttonDown = wx.Button(parent = self.panelControl, label = "\\/")
@@ -377,84 +424,118 @@ class WizardFrame(wx.Frame):
         self.buttonDown.Enable(False)
         panelControlSizer.Add(self.buttonDown, 2, wx.ALIGN_CENTER_HORIZONTAL | wx.BOTTOM, 5)
         panelControlSizer.AddStretchSpacer(1)
-        self.buttonDown.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
         # Level Status Panel
         self.panelLevelStatus = wx.Panel(self.panelBottom)
         panelLevelStatusSizer = wx.BoxSizer(wx.VERTICAL)
         self.panelLevelStatus.SetSizer(panelLevelStatusSizer)
         panelBottomSizer.Add(self.panelLevelStatus, 1, wx.EXPAND)
-        self.panelLevelStatus.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
         # Level Status Gauge
         self.gaugeLevel = wx.Gauge(parent = self.panelLevelStatus, style = wx.GA_VERTICAL)
         self.gaugeLevel.SetRange(1)
         self.gaugeLevel.SetValue(1)
         panelLevelStatusSizer.Add(self.gaugeLevel, 1, wx.ALIGN_CENTER_HORIZONTAL | wx.BOTTOM | wx.LEFT, 10)
-        self.gaugeLevel.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
         # Level Panel
         self.panelLevel = wx.Panel(self.panelBottom)
         panelLevelSizer = wx.BoxSizer(wx.VERTICAL)
         self.panelLevel.SetSizer(panelLevelSizer)
         panelBottomSizer.Add(self.panelLevel, 2, wx.EXPAND)
-        self.panelLevel.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
         # Start Button
         self.buttonStart = wx.Button(parent = self.panelLevel, label = "Start")
         self.buttonStart.Bind(wx.EVT_BUTTON, self.OnStart)
         self.buttonStart.Enable(False)
         panelLevelSizer.Add(self.buttonStart, 0, wx.ALIGN_RIGHT | wx.RIGHT | wx.TOP, 5)
-        self.buttonStart.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
         # Next Button
         self.buttonNext = wx.Button(parent = self.panelLevel, label = "Next")
         self.buttonNext.Bind(wx.EVT_BUTTON, self.OnNext)
         self.buttonNext.Enable(False)
         panelLevelSizer.Add(self.buttonNext, 0, wx.ALIGN_RIGHT | wx.RIGHT | wx.TOP, 5)
-        self.buttonNext.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
         self.buttonSave = wx.Button(parent = self.panelLevel, label = "Save")
         self.buttonSave.Bind(wx.EVT_BUTTON, self.OnSave)
         self.buttonSave.Enable(False)
         panelLevelSizer.Add(self.buttonSave, 0, wx.ALIGN_RIGHT | wx.RIGHT | wx.TOP | wx.BOTTOM, 5)
-        self.buttonSave.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
 
         self.SetSizerAndFit(outerPanelSizer)
         #self.SetSizer(outerPanelSizer)
 
+        # Single timer driving all periodic polling
+        self.pollTicks = 0
+        self.pollTimer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.OnPollTimer, self.pollTimer)
+        self.pollTimer.Start(POLL_TIMER_INTERVALL)
+
+    def OnPollTimer(self, event):
+        self.pollTicks += 1
+
+        # The port can't be changed while connected, so don't bother looking
+        if not self.isConnected and self.pollTicks % POLL_SERIAL_PORTS_TICKS == 0:
+            self.EnumerateSerialPorts()
+
+        if self.isConnected:
+            # Reader thread is gone, so is the serial link
+            if not self.thread.alive:
+                self.OnConnectDisconnect(event)
+                return
+
+            try:
+                if self.pollTicks % POLL_COORDINATES_TICKS == 0:
+                    self.PollPosition()
+                if self.pollTicks % POLL_TEMPERATURE_TICKS == 0:
+                    self.PollTemperature()
+                if self.isPollingMeshData and self.pollTicks % MESH_DATA_RETRY_TICKS == 0:
+                    self.PollMeshDataRetry()
+            except (serial.SerialException, OSError) as msg:
+                log.error("Polling the printer failed: %s", msg)
+                self.OnConnectDisconnect(event)
+
     def EnumerateSerialPorts(self):
         # List all available serial ports
-        serialPortList = serial.tools.list_ports.comports()
+        serialPortNames = [port.device for port in serial.tools.list_ports.comports()]
+
+        # Only touch the Combobox if the available ports have changed
+        serialPorts = frozenset(serialPortNames)
+        if serialPorts == self.lastSerialPorts:
+            return
+        self.lastSerialPorts = serialPorts
 
         # Fill Combobox, remember selected value
         selection = self.comboBoxSerial.GetValue()
         self.comboBoxSerial.Clear()
-        for port in serialPortList:
-            self.comboBoxSerial.Append(port[0])
-            if port[0] == selection:
-                self.comboBoxSerial.SetStringSelection(selection)
+        for name in serialPortNames:
+            self.comboBoxSerial.Append(name)
+        if selection in serialPorts:
+            self.comboBoxSerial.SetStringSelection(selection)
 
         # Select first port if nothing is selected
-        if not selection:
-            self.comboBoxSerial.SetStringSelection(serialPortList[0][0])
+        if not selection and serialPortNames:
+            self.comboBoxSerial.SetStringSelection(serialPortNames[0])
 
         self.panelSerial.Layout()
 
-        # Check every 5 seconds for new available serial ports
-        wx.FutureCall(POLL_SERIAL_PORTS_INTERVALL, self.EnumerateSerialPorts)
+    # Native widget updates are comparatively expensive, skip the no-ops
+    def UpdateLabel(self, label, text):
+        if text != label.GetLabel():
+            label.SetLabel(text)
+
+    def UpdateGauge(self, gauge, value):
+        if value != gauge.GetValue():
+            gauge.SetValue(value)
 
     def EnableDisableUI(self):
         if not self.isConnected:
-            self.buttonSerial.SetLabel("Connect")
-            self.labelX.SetLabel("X: ??.??")
-            self.labelY.SetLabel("Y: ??.??")
-            self.labelZ.SetLabel("Z: ??.??")
-            self.labelZc.SetLabel("Zc: ??.???")
+            self.UpdateLabel(self.buttonSerial, "Connect")
+            self.UpdateLabel(self.labelX, "X: ??.??")
+            self.UpdateLabel(self.labelY, "Y: ??.??")
+            self.UpdateLabel(self.labelZ, "Z: ??.??")
+            self.UpdateLabel(self.labelZc, "Zc: ??.???")
         else:
-            self.buttonSerial.SetLabel("Disconnect")
+            self.UpdateLabel(self.buttonSerial, "Disconnect")
 
-        self.panelStatus.Layout()
         self.panelSerial.Layout()
 
         self.comboBoxSerial.Enable(not self.isConnected)
@@ -481,81 +562,83 @@ class WizardFrame(wx.Frame):
 
     def OnSave(self, event):
         if self.isLeveling:
-            print "Leveling is already in progress!"
+            log.warning("Leveling is already in progress!")
             return
 
-        self.protocol.write_line(GCODE_EEPROM_SAVE)
+        self.thread.write_line(GCODE_EEPROM_SAVE)
 
     def OnStart(self, event):
         if self.isLeveling:
-            print "Leveling is already in progress!"
+            log.warning("Leveling is already in progress!")
             return
 
         self.isLeveling = True
         self.currentPoint = 0
-        self.gauge.SetValue(0)
-        self.protocol.write_line(GCODE_MESH_START)
-        self.gaugeLevel.SetValue(0)
+        self.UpdateGauge(self.gauge, 0)
+        self.thread.write_line(GCODE_MESH_START)
+        self.UpdateGauge(self.gaugeLevel, 0)
         self.EnableDisableUI()
 
     def OnNext(self, event):
         if not self.isLeveling:
-            print "Start leveling before proceeding!"
+            log.warning("Start leveling before proceeding!")
             return
 
-        self.gauge.SetValue(0)
-        self.protocol.write_line(GCODE_MESH_NEXT)
+        self.UpdateGauge(self.gauge, 0)
+        self.thread.write_line(GCODE_MESH_NEXT)
         self.currentPoint += 1
         if self.currentPoint >= self.meshPoints:
             self.isLeveling = False
-        self.gaugeLevel.SetValue(self.currentPoint)
+        self.UpdateGauge(self.gaugeLevel, self.currentPoint)
         self.EnableDisableUI()
         self.currentZ = self.startZ
-        self.labelZc.SetLabel("Zc: {}".format(self.currentZ))
-        self.panelStatus.Layout()
+        self.UpdateLabel(self.labelZc, "Zc: %s" % self.currentZ)
 
     def OnNewStepSize(self, event):
-        print "New Step Size: {}".format(self.stepSize.GetValue())
+        log.debug("New Step Size: %s", self.stepSize.GetValue())
         self.step = float(self.stepSize.GetValue())
 
-    def OnKeyDown(self, event):
-        key = event.GetKeyCode()
+    def OnCharHook(self, event):
+        # Leave the arrow keys to text fields and comboboxes
+        if not self.isConnected or isinstance(wx.Window.FindFocus(), (wx.TextCtrl, wx.ComboBox)):
+            event.Skip()
+            return
 
-        if self.isConnected:
-            if key == wx.WXK_DOWN:
-                self.OnDown(event)
-            elif key == wx.WXK_UP:
-                self.OnUp(event)
-            elif key == wx.WXK_RIGHT:
-                self.OnNext(event)
+        key = event.GetKeyCode()
+        if key == wx.WXK_DOWN:
+            self.OnDown(event)
+        elif key == wx.WXK_UP:
+            self.OnUp(event)
+        elif key == wx.WXK_RIGHT:
+            self.OnNext(event)
+        else:
+            event.Skip()
 
     def OnUp(self, event):
-        self.currentZ += self.step
-        print "Moving up to {}".format(self.currentZ)
-        self.gauge.SetValue(0)
-        self.protocol.write_line(GCODE_MOVE_Z.format(self.currentZ))
-        self.labelZc.SetLabel("Zc: {}".format(self.currentZ))
-        self.panelStatus.Layout()
+        self.currentZ = round(self.currentZ + self.step, Z_DECIMALS)
+        log.debug("Moving up to %s", self.currentZ)
+        self.UpdateGauge(self.gauge, 0)
+        self.thread.write(gcode_move_z(self.currentZ))
+        self.UpdateLabel(self.labelZc, "Zc: %s" % self.currentZ)
 
     def OnDown(self, event):
         if self.currentZ <= 0.0:
-            print "Can't move further down!"
+            log.warning("Can't move further down!")
             return
 
-        self.currentZ -= self.step
-        print "Moving down to {}".format(self.currentZ)
-        self.gauge.SetValue(0)
-        self.protocol.write_line(GCODE_MOVE_Z.format(self.currentZ))
-        self.labelZc.SetLabel("Zc: {}".format(self.currentZ))
-        self.panelStatus.Layout()
+        self.currentZ = round(self.currentZ - self.step, Z_DECIMALS)
+        log.debug("Moving down to %s", self.currentZ)
+        self.UpdateGauge(self.gauge, 0)
+        self.thread.write(gcode_move_z(self.currentZ))
+        self.UpdateLabel(self.labelZc, "Zc: %s" % self.currentZ)
 
     def OnStepperOff(self, event):
-        self.gauge.SetValue(0)
-        self.protocol.write_line(GCODE_STOP_IDLE_HOLD)
+        self.UpdateGauge(self.gauge, 0)
+        self.thread.write_line(GCODE_STOP_IDLE_HOLD)
 
     def OnHome(self, event):
-        self.gauge.SetValue(0)
-        self.protocol.write_line(GCODE_MOVE_TO_ORIGIN)
+        self.UpdateGauge(self.gauge, 0)
+        self.thread.write_line(GCODE_MOVE_TO_ORIGIN)
 
     def OnStatus(self, event):
         if event.GetValue() == 0:
@@ -569,66 +652,74 @@ class WizardFrame(wx.Frame):
             self.gauge.SetValue(val + 1)
 
     def OnDone(self, event):
-        self.gauge.SetValue(self.gauge.GetRange())
+        self.UpdateGauge(self.gauge, self.gauge.GetRange())
 
     def PollMeshData(self):
         if self.isConnected:
-            self.protocol.write_line(GCODE_MESH_INFO)
+            self.thread.write(GCODE_LINE_MESH_INFO)
 
     def PollMeshDataRetry(self):
         if self.meshPoints <= 0:
             self.PollMeshData()
-            wx.FutureCall(MESH_DATA_RETRY_TIMEOUT, self.PollMeshDataRetry)
+        else:
+            self.isPollingMeshData = False
 
     def OnMeshPoints(self, event):
-        x = int(event.GetX())
-        y = int(event.GetY())
+        x, y = event.GetValue()
+        x = int(x)
+        y = int(y)
         self.meshPoints = x * y
-        print "Mesh Points: X: {} Y: {} --> {}".format(x, y, self.meshPoints)
+        self.isPollingMeshData = self.meshPoints <= 0
+        log.debug("Mesh Points: X: %s Y: %s --> %s", x, y, self.meshPoints)
         self.gaugeLevel.SetRange(self.meshPoints)
-        self.gaugeLevel.SetValue(0)
+        self.UpdateGauge(self.gaugeLevel, 0)
         self.EnableDisableUI()
 
     def OnMeshZ(self, event):
-        self.startZ = float(event.GetZ())
-        self.currentZ = float(event.GetZ())
-        self.labelZc.SetLabel("Zc: {}".format(self.currentZ))
-        self.gauge.SetValue(BUSY_PROCESSING_STEPS)
-        print "Mesh starting height: {}".format(self.currentZ)
+        self.startZ = float(event.GetValue())
+        self.currentZ = float(event.GetValue())
+        self.UpdateLabel(self.labelZc, "Zc: %s" % self.currentZ)
+        self.UpdateGauge(self.gauge, BUSY_PROCESSING_STEPS)
+        log.debug("Mesh starting height: %s", self.currentZ)
+
+    # Don't queue up another poll while the printer hasn't answered the last one
+    def IsPollPending(self, sentTick):
+        return sentTick is not None and self.pollTicks - sentTick < POLL_RESPONSE_TIMEOUT_TICKS
 
     def PollPosition(self):
-        if self.isConnected:
+        if self.isConnected and not self.IsPollPending(self.positionPollTick):
             #if not self.isLeveling:
-            self.protocol.write_line(GCODE_GET_CURRENT_POSITION)
-            wx.FutureCall(POLL_COORDINATES_INTERVALL, self.PollPosition)
+            self.thread.write(GCODE_LINE_GET_CURRENT_POSITION)
+            self.positionPollTick = self.pollTicks
 
     def OnCoordinates(self, event):
-        data = event.GetValue()
-        print "New coordinates {}".format(data)
-        afterX = data.split("X: ")[1]
-        x = afterX.split(" ")[0]
-        afterY = data.split("Y: ")[1]
-        y = afterY.split(" ")[0]
-        afterZ = data.split("Z: ")[1]
-        z = afterZ.split(" ")[0]
+        self.positionPollTick = None
+        if event.GetValue() is None:
+            log.debug("Unknown coordinates format")
+            return
 
-        self.labelX.SetLabel("X: {}".format(x))
-        self.labelY.SetLabel("Y: {}".format(y))
-        self.labelZ.SetLabel("Z: {}".format(z))
+        x, y, z = event.GetValue()
+        log.debug("New coordinates X: %s Y: %s Z: %s", x, y, z)
 
-        self.panelStatus.Layout()
+        self.UpdateLabel(self.labelX, "X: " + x)
+        self.UpdateLabel(self.labelY, "Y: " + y)
+        self.UpdateLabel(self.labelZ, "Z: " + z)
 
     def OnTemperature(self, event):
-        print "Current Bed Temperature: {}".format(event.GetBed())
-        self.bedTemperatureLabel.SetLabel("Bed: {}".format(event.GetBed()))
+        self.temperaturePollTick = None
+        if event.GetValue() is None:
+            return
+
+        log.debug("Current Bed Temperature: %s", event.GetValue())
+        self.UpdateLabel(self.bedTemperatureLabel, "Bed: %s" % event.GetValue())
 
     def OnNewBedTemperature(self, event):
-        self.protocol.write_line(GCODE_SET_BED_TEMP.format(float(self.bedTemperature.GetValue())))
+        self.thread.write(gcode_set_bed_temp(float(self.bedTemperature.GetValue())))
 
     def PollTemperature(self):
-        if self.isConnected:
-            self.protocol.write_line(GCODE_GET_TEMP)
-            wx.FutureCall(POLL_TEMPERATURE_INTERVALL, self.PollTemperature)
+        if self.isConnected and not self.IsPollPending(self.temperaturePollTick):
+            self.thread.write(GCODE_LINE_GET_TEMP)
+            self.temperaturePollTick = self.pollTicks
 
     def OnConnectDisconnect(self, Event):
         self.isLeveling = False
@@ -637,39 +728,50 @@ class WizardFrame(wx.Frame):
             self.thread.close()
             self.serial.close()
             self.isConnected = False
-            self.gauge.SetValue(0)
+            self.isPollingMeshData = False
+            self.UpdateGauge(self.gauge, 0)
             self.gaugeLevel.SetRange(1)
-            self.gaugeLevel.SetValue(1)
+            self.UpdateGauge(self.gaugeLevel, 1)
             self.EnableDisableUI()
 
             # Recreate thread, so we can start it again next time
-            self.thread = serial.threaded.ReaderThread(self.serial, GCodeReader)
+            self.thread = GCodeReader(self.serial, self)
         else:
             self.serial.baudrate = self.comboBoxBaud.GetValue()
             self.serial.port = self.comboBoxSerial.GetValue()
             try:
                 self.serial.open()
             except serial.SerialException as msg:
-                wx.MessageBox("SerialException: {}".format(msg), "Error", wx.OK | wx.ICON_ERROR)
+                wx.MessageBox("SerialException: %s" % msg, "Error", wx.OK | wx.ICON_ERROR)
             except OSError as msg:
-                wx.MessageBox("OSError: {}".format(msg), "Error", wx.OK | wx.ICON_ERROR)
+                wx.MessageBox("OSError: %s" % msg, "Error", wx.OK | wx.ICON_ERROR)
             if self.serial.isOpen():
                 self.isConnected = True
                 self.thread.start()
-                self.transport, self.protocol = self.thread.connect()
-                self.protocol.setParent(self)
                 self.meshPoints = -1
+                self.isPollingMeshData = True
                 self.EnableDisableUI()
+
+                # Start the polling periods relative to the new connection
+                self.pollTicks = 0
+                self.positionPollTick = None
+                self.temperaturePollTick = None
+
                 self.PollPosition()
                 self.PollMeshData()
                 self.PollTemperature()
-                wx.FutureCall(MESH_DATA_RETRY_TIMEOUT, self.PollMeshDataRetry)
+
+    def OnConnectionLost(self, event):
+        if self.isConnected:
+            self.OnConnectDisconnect(event)
+            wx.MessageBox("Connection lost: %s" % event.GetValue(), "Error", wx.OK | wx.ICON_ERROR)
 
     def OnQuit(self, Event):
         if not self.hasQuit:
             self.hasQuit = True
+            self.pollTimer.Stop()
             if self.isConnected:
-                print("Closing serial port...")
+                log.info("Closing serial port...")
                 self.thread.close()
                 self.serial.close()
                 self.isConnected = False
@@ -699,6 +801,7 @@ class WizardApp(wx.App):
         self.BringWindowToFront()
 
 def main():
+    logging.basicConfig(level = LOG_LEVEL)
     app = WizardApp(False)
     app.MainLoop()
 